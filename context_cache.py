@@ -0,0 +1,88 @@
+### On-disk cache of computed contexts, so repeated runs over the same inputs (e.g. with different templates)
+### can skip loading, linking and context computation and go straight to rendering.
+###
+### Contexts are stored column-wise (one list per Context attribute) in a pickle file named by a hash of
+### the input files and of the configuration used to compute the contexts.
+
+import hashlib
+import json
+import os
+import pickle
+import uuid
+
+from context import Context
+
+# change whenever the cached data, or the way it is computed, changes
+CACHE_FORMAT_VERSION = 2
+
+
+def cache_key(fNames, config):
+  '''
+  :param fNames: the input file names (None entries are ignored)
+  :param config: JSON-serializable configuration that affects the computed contexts (column labels, defaults, etc.)
+  :return: hex digest identifying the cached contexts for these inputs and configuration
+  '''
+  digest = hashlib.sha256()
+  digest.update(str(CACHE_FORMAT_VERSION).encode())
+  digest.update(json.dumps(config, sort_keys=True).encode())
+  for fName in fNames:
+    digest.update(b'\0')
+    if not fName:
+      continue
+    with open(fName, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        digest.update(chunk)
+  return digest.hexdigest()
+
+def cache_file_name(cacheDir, key):
+  return os.path.join(cacheDir, key + '.pickle')
+
+def save_contexts(cacheDir, key, contexts):
+  '''
+  :param cacheDir: the cache directory, created if necessary
+  :param key: the cache key, from cache_key()
+  :param contexts: list of Context objects to cache
+  '''
+  fields = list(vars(Context()))
+  cached = {
+    'version': CACHE_FORMAT_VERSION,
+    'count':   len(contexts),
+    'columns': {field: [getattr(context, field) for context in contexts] for field in fields}
+  }
+  os.makedirs(cacheDir, exist_ok=True)
+  fName = cache_file_name(cacheDir, key)
+  tmpFName = fName + '.tmp'
+  with open(tmpFName, 'wb') as f:
+    pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+  os.replace(tmpFName, fName)
+
+def load_contexts(cacheDir, key):
+  '''
+  :param cacheDir: the cache directory
+  :param key: the cache key, from cache_key()
+  :return: list of Context objects, or None if not cached
+
+  Event and transformation IDs are regenerated, so that each run produces new events.
+  '''
+  fName = cache_file_name(cacheDir, key)
+  if not os.path.exists(fName):
+    return None
+  try:
+    with open(fName, 'rb') as f:
+      cached = pickle.load(f)
+  except Exception as e:
+    print('WARNING: could not read cache file ' + fName + ': ' + str(e))
+    return None
+  if cached.get('version') != CACHE_FORMAT_VERSION:
+    return None
+
+  contexts = []
+  columns = cached['columns']
+  for index in range(cached['count']):
+    context = Context()
+    for field, values in columns.items():
+      setattr(context, field, values[index])
+    context.EventID          = str(uuid.uuid4().urn)
+    context.TransformationID = str(uuid.uuid4().urn)
+    contexts.append(context)
+  return contexts
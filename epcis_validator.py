@@ -0,0 +1,177 @@
+### Streaming validation of generated EPCIS XML documents
+###
+### Documents are parsed incrementally and each event is discarded once checked, so memory use does not
+### grow with the size of the document. Checks are:
+### • the document is well-formed XML
+### • each event has the elements required for its type, and at least one item
+### • identifiers are non-empty, do not contain 'None', and match the URN syntax of the schemes in gs1_urn
+### • event times and expiration, sell by and best before dates are valid xsd:dateTime/xsd:date values
+###
+### Usage: python3 epcis_validator.py FILE [FILE ...]
+
+import json
+import re
+import sys
+import xml.etree.ElementTree as ET
+
+# utilities for handling GS1 (GTIN, GLN, SSCC, etc.)
+import gs1_urn
+
+EVENT_TYPES = ('ObjectEvent', 'AggregationEvent', 'TransactionEvent', 'TransformationEvent')
+
+# elements which must be present, and not empty, for each event type
+REQUIRED_ELEMENTS = {
+  'ObjectEvent':          ('eventTime', 'eventTimeZoneOffset', 'action'),
+  'AggregationEvent':     ('eventTime', 'eventTimeZoneOffset', 'action', 'parentID'),
+  'TransactionEvent':     ('eventTime', 'eventTimeZoneOffset', 'action', 'bizTransactionList'),
+  'TransformationEvent':  ('eventTime', 'eventTimeZoneOffset')
+}
+
+# paths (relative to the event) of the elements listing the items of each event type. For transformations,
+# both input and output items are required
+ITEM_PATHS = {
+  'ObjectEvent':          (('.//epcList/epc', './/quantityList//epcClass'),),
+  'AggregationEvent':     (('.//childEPCs/epc', './/childQuantityList//epcClass'),),
+  'TransactionEvent':     (('.//epcList/epc', './/quantityList//epcClass'),),
+  'TransformationEvent':  (('.//inputEPCList/epc', './/inputQuantityList//epcClass'),
+                           ('.//outputEPCList/epc', './/outputQuantityList//epcClass'))
+}
+
+# elements containing identifiers generated by gs1_urn
+URN_ELEMENTS = ('epc', 'epcClass', 'parentID', 'id', 'bizTransaction', 'source', 'destination')
+
+EVENT_TIME_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})')
+
+# master data (ilmd) elements which must be xsd:date values
+DATE_ELEMENTS = ('itemExpirationDate', 'sellByDate', 'bestBeforeDate')
+
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}(Z|[+-]\d{2}:\d{2})?')
+
+
+def local_name(tag):
+  return tag.rsplit('}', 1)[-1]
+
+# strip namespaces from all elements of an event, so that checks can use simple paths
+def strip_namespaces(element):
+  for child in element.iter():
+    child.tag = local_name(child.tag)
+
+# return a list of (error type, element, value) for an event
+def event_errors(event):
+  errors = []
+  eventType = event.tag
+
+  for name in REQUIRED_ELEMENTS[eventType]:
+    element = event.find(name)
+    if element is None:
+      errors.append(('missing ' + name, name, None))
+    elif not len(element) and not (element.text or '').strip():
+      errors.append(('empty ' + name, name, None))
+
+  for alternatives in ITEM_PATHS[eventType]:
+    if not any((element.text or '').strip() for path in alternatives for element in event.iterfind(path)):
+      errors.append(('no items', ' or '.join(alternatives), None))
+
+  eventTime = event.findtext('eventTime')
+  if eventTime and eventTime.strip() and not EVENT_TIME_PATTERN.fullmatch(eventTime.strip()):
+    errors.append(('invalid eventTime', 'eventTime', eventTime.strip()))
+
+  for name in DATE_ELEMENTS:
+    for element in event.iterfind('.//' + name):
+      value = (element.text or '').strip()
+      if not DATE_PATTERN.fullmatch(value):
+        errors.append(('invalid date', name, value))
+
+  # read point ids are taken as given from the input, so may be any URN
+  readPointIds = set(event.iterfind('readPoint/id'))
+  for element in event.iter():
+    if element.tag not in URN_ELEMENTS or len(element):
+      continue
+    name = 'readPoint/id' if element in readPointIds else ('bizLocation/id' if element.tag == 'id' else element.tag)
+    value = (element.text or '').strip()
+    if not value:
+      errors.append(('empty ' + name, name, None))
+    elif 'None' in value:
+      errors.append(('None value', name, value))
+    elif element in readPointIds:
+      if not value.startswith('urn:'):
+        errors.append(('invalid URN', name, value))
+    elif not gs1_urn.urn_scheme_of(value):
+      errors.append(('invalid URN', name, value))
+  return errors
+
+def validate_file(fName, maxErrors=100):
+  '''
+  :param fName: name of the EPCIS XML file to validate
+  :param maxErrors: maximum number of individual errors to list in the report (all errors are counted)
+  :return: dictionary containing the validation report
+  '''
+  report = {
+    'file':         fName,
+    'wellFormed':   True,
+    'valid':        True,
+    'eventCount':   0,
+    'eventTypes':   {},
+    'errorCounts':  {},
+    'errors':       []
+  }
+
+  # elements currently open, and the number of those which are events
+  stack = []
+  eventDepth = 0
+  try:
+    for parseEvent, element in ET.iterparse(fName, events=('start', 'end')):
+      if parseEvent == 'start':
+        stack.append(element)
+        if local_name(element.tag) in EVENT_TYPES:
+          eventDepth += 1
+        continue
+
+      stack.pop()
+      if local_name(element.tag) in EVENT_TYPES:
+        eventDepth -= 1
+        strip_namespaces(element)
+        eventIndex = report['eventCount']
+        report['eventCount'] += 1
+        report['eventTypes'][element.tag] = report['eventTypes'].get(element.tag, 0) + 1
+        for errorType, name, value in event_errors(element):
+          report['errorCounts'][errorType] = report['errorCounts'].get(errorType, 0) + 1
+          if len(report['errors']) < maxErrors:
+            report['errors'].append({'event': eventIndex, 'type': errorType, 'element': name, 'value': value})
+
+      # discard everything outside of an event as soon as it is complete
+      if not eventDepth and stack:
+        element.clear()
+        stack[-1].remove(element)
+  except ET.ParseError as e:
+    report['wellFormed'] = False
+    report['parseError'] = str(e)
+
+  report['valid'] = report['wellFormed'] and not report['errorCounts']
+  return report
+
+def validate_files(fNames, reportFName=None, maxErrors=100):
+  '''
+  :param fNames: names of the EPCIS XML files to validate
+  :param reportFName: if set, name of the file to write the JSON report to
+  :param maxErrors: maximum number of individual errors to list in the report, per file
+  :return: list of reports, one per file
+  '''
+  reports = [validate_file(fName, maxErrors) for fName in fNames]
+  for report in reports:
+    status = 'VALID' if report['valid'] else 'INVALID'
+    print('VALIDATION: ' + status + ' ' + report['file'] + ', events: ' + str(report['eventCount']) +
+          ', errors: ' + json.dumps(report['errorCounts'], sort_keys=True))
+  if reportFName:
+    with open(reportFName, 'w') as reportFile:
+      json.dump(reports, reportFile, indent=2)
+  return reports
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 2:
+    print('usage: epcis_validator.py FILE [FILE ...]')
+    exit()
+  reports = validate_files(sys.argv[1:])
+  print(json.dumps(reports, indent=2))
+  sys.exit(0 if all(report['valid'] for report in reports) else 1)
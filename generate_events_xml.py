@@ -1,12 +1,17 @@
 import os
 import sys
 import collections
+import copy
 import csv
 import json
 import jinja2
+import re
 import uuid
 from datetime import datetime, date, time
 import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # data fields to load from spreadsheets
 from data_key import DataKey
@@ -19,50 +24,76 @@ from grouping_function import GroupingFunction
 # utilities for handling GS1 (GTIN, GLN, SSCC, etc.)
 import gs1_urn
 
+# streaming reader for Excel (.xlsx) input files
+from xlsx_reader import read_xlsx_rows
+
+# on-disk cache of computed contexts
+import context_cache
+
+# streaming validation of generated EPCIS documents
+import epcis_validator
+
+# lookup index over product and location master data
+from identifier_index import IdentifierIndex
+
+# per-stage timing and profiling of a run
+from stage_profiler import StageProfiler, profiled
+
 # load a JINJA template to process
 def get_template(template_path):
   path, filename = os.path.split(template_path)
   return jinja2.Environment(loader=jinja2.FileSystemLoader(path or './')).get_template(filename)
 
+# split an input file name into the path and sheet name. A sheet of an Excel (.xlsx) file can be selected by
+# appending '#' and the sheet name, e.g. Data.xlsx#Products. The sheet name is None if not specified
+def split_sheet_name(fName):
+  xlsxMatch = re.fullmatch(r'(.+\.xlsx)(?:#(.+))?', fName, re.IGNORECASE)
+  if xlsxMatch:
+    return xlsxMatch.group(1), xlsxMatch.group(2)
+  return fName, None
+
+# read spreadsheet rows as dictionaries keyed by column header, from either a CSV or an Excel (.xlsx) file
+def read_rows(fName):
+  path, sheetName = split_sheet_name(fName)
+  if path.lower().endswith('.xlsx'):
+    yield from read_xlsx_rows(path, sheetName)
+  else:
+    with open(fName, newline='', encoding='utf-8-sig') as csvfile:
+      yield from csv.DictReader(csvfile)
+
 # load a spreadsheet data into list of records
 def load_event_data(fName):
   data = []
-  with open(fName, newline='', encoding='utf-8-sig') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-      data.append(row)
+  for row in read_rows(fName):
+    data.append(row)
   return data
 
 # load spreadsheet data into dictionary, with specified field as key
 def load_keyed_data(fName, keyName):
   data = {}
-  with open(fName, newline='', encoding='utf-8-sig') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-      keyValue = row.get(keyName)
-      if keyValue:
-        data[keyValue] = row
-      else:
-        print('WARNING: load_keyed_data ' + str(keyName) + ' not found')
+  for row in read_rows(fName):
+    keyValue = row.get(keyName)
+    if keyValue:
+      data[keyValue] = row
+    else:
+      print('WARNING: load_keyed_data ' + str(keyName) + ' not found')
   return data
 
 # load spreadsheet data into dictionary, with specified field as key and 
 def load_grouped_data(fName, keyName, grouping_type):
   data = {}
-  with open(fName, newline='', encoding='utf-8-sig') as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-      keyValue = row.get(keyName)
-      if keyValue:
-        group = keyValue if grouping_type == GroupingFunction.EQUALITY else group_of(grouping_type, keyValue)
-        if (group in data):
-          data[group].append(row)
-          print("APPENDING TO GROUP: " + str(group))
-        else:
-          data[group] = [row]
-          print("CREATING TO GROUP: " + str(group))
+  for row in read_rows(fName):
+    keyValue = row.get(keyName)
+    if keyValue:
+      group = keyValue if grouping_type == GroupingFunction.EQUALITY else group_of(grouping_type, keyValue)
+      if (group in data):
+        data[group].append(row)
+        print("APPENDING TO GROUP: " + str(group))
       else:
-        print('WARNING: load_keyed_data ' + str(keyName) + ' not found')
+        data[group] = [row]
+        print("CREATING TO GROUP: " + str(group))
+    else:
+      print('WARNING: load_keyed_data ' + str(keyName) + ' not found')
   return data
 
 def group_of(grouping_type, value):
@@ -80,9 +111,14 @@ def group_of(grouping_type, value):
   return grouping
   
 def convert_to_date(dateStr: str):
+  # already parsed, e.g. an Excel date cell
+  if isinstance(dateStr, datetime):
+    return dateStr.date()
+  if isinstance(dateStr, date):
+    return dateStr
   try:
-    date = datetime.strptime(dateStr, '%m/%d/%y').date()
-    return date
+    parsed = datetime.strptime(dateStr, '%m/%d/%y').date()
+    return parsed
   except:
     return None
 
@@ -108,20 +144,31 @@ def week_of(dateStr):
   else:
     return None
 
-# generate date+time string from component pieces
-def calculateTimeInfo(date, time):
-  if time:
+# generate date+time from component pieces. Each piece is either a string or an already parsed value
+# (e.g. from an Excel date or time cell), which is used directly
+def calculateTimeInfo(dateValue, timeValue):
+  if isinstance(dateValue, date):
+    if isinstance(timeValue, time):
+      return datetime.combine(dateValue, timeValue)
+    # date and time in a single cell. Date-only cells are read as midnight, so are treated as having no time
+    if isinstance(dateValue, datetime) and not timeValue and dateValue.time() != time.min:
+      return dateValue
+    dateValue = dateValue.strftime('%m/%d/%y')
+  if isinstance(timeValue, time):
+    timeValue = timeValue.strftime('%H:%M:%S')
+
+  if timeValue:
     # distinguish between 24-hour vs 12-hour times (assume 12-hour ends with AM or PM)
-    if time.endswith(('m','M')):
-      dateTime = datetime.strptime(date + ' ' + time, '%m/%d/%y %I:%M:%S %p')
+    if timeValue.endswith(('m','M')):
+      dateTime = datetime.strptime(dateValue + ' ' + timeValue, '%m/%d/%y %I:%M:%S %p')
     else:
-      dateTime = datetime.strptime(date + ' ' + time, '%m/%d/%y %H:%M:%S')
+      dateTime = datetime.strptime(dateValue + ' ' + timeValue, '%m/%d/%y %H:%M:%S')
     return dateTime
   else:
     return None
 
 # look up product by specified code, returning either GS1 LGTIN or IFT LGTIN
-# Parameter 'code' is used as a key into the 'product' dictionary to find a GTIN.
+# Parameter 'code' is used as a key into the 'products' index to find a GTIN.
 # If a GTIN is found, then a GTIN URN is returned (or created based on the GTIN). 
 # Otherwise, an IFT GTIN is returned
 def gtinOf(products, company_prefix, code, lot):
@@ -129,13 +176,15 @@ def gtinOf(products, company_prefix, code, lot):
   if gs1_urn.already_urn(code):
     return gs1_urn.add_urn_suffix_if_necessary(code, lot)
     
-  product = products.get(code, None)
+  product = products.lookup(code)
   if product:
-    gtin = product.get('GTIN', None)
-    if gtin:
-      result = gs1_urn.lgtin_data_to_urn(company_prefix, gtin, lot)
+    if product.code:
+      # use the GS1 item reference if the GTIN is in the company prefix, otherwise the GTIN as given
+      reference = product.reference(company_prefix)
+      result = gs1_urn.lgtin_data_to_urn(company_prefix, product.code if reference is None else reference, lot)
     else:
-      result = gs1_urn.ift_lgtin_data_to_urn(company_prefix, code, lot)
+      # use the master data key, so that all spellings of the code matched give the same identifier
+      result = gs1_urn.ift_lgtin_data_to_urn(company_prefix, product.key, lot)
   else:
     print('WARNING: gtinOf ' + str(code) + ' not found')
     result = None
@@ -143,7 +192,7 @@ def gtinOf(products, company_prefix, code, lot):
   return result
 
 
-# Parameter 'code' is used as a key into the 'locations' dictionary to find a GLN.
+# Parameter 'code' is used as a key into the 'locations' index to find a GLN.
 # If a GLN is found, then a GLN URN is returned (or created based on the GLN). 
 # Otherwise, an IFT GLN is returned
 def glnOf(locations, company_prefix, code, extension = None):
@@ -151,13 +200,16 @@ def glnOf(locations, company_prefix, code, extension = None):
   if gs1_urn.already_urn(code):
     return gs1_urn.add_urn_suffix_if_necessary(code, extension)
     
-  location = locations.get(code, None)
+  location = locations.lookup(code)
   if location:
-    gln = location.get('GLN', None)
-    if gln:
-      result = gs1_urn.sgln_data_to_urn(company_prefix, gln, extension)
+    if location.code:
+      # use the GS1 location reference if the GLN is in the company prefix, otherwise the GLN as given.
+      # The reference is empty for a 12-digit company prefix
+      reference = location.reference(company_prefix)
+      result = gs1_urn.sgln_data_to_urn(company_prefix, location.code if reference is None else reference, extension)
     else:
-      result = gs1_urn.ift_sgln_data_to_urn(company_prefix, code, extension)
+      # use the master data key, so that all spellings of the code matched give the same identifier
+      result = gs1_urn.ift_sgln_data_to_urn(company_prefix, location.key, extension)
   else:
     print('WARNING: glnOf ' + str(code) + ' not found')
     result = None
@@ -177,9 +229,16 @@ def productionOrderOf(company_prefix, prod):
 def ssccOf(company_prefix, sscc):
   return gs1_urn.sscc_data_to_urn(company_prefix, sscc) if sscc else None
   
-# look up specified data item. If not set, return its default value, if any--otherwise None
+# date and time items, combined into event times by calculateTimeInfo
+TIME_INFO_KEYS = frozenset([DataKey.DATE, DataKey.FROM_DATE, DataKey.TO_DATE, DataKey.TIME, DataKey.FROM_TIME, DataKey.TO_TIME])
+
+# look up specified data item. If not set, return its default value, if any--otherwise None.
+# Already parsed dates (e.g. from Excel date cells) are returned as ISO dates, other than for TIME_INFO_KEYS
 def valueOf(dataItem, dataKey):
-  return dataItem.get(g_columnLabels.get(dataKey.value, None), g_defaultValues.get(dataKey.value, None))
+  value = dataItem.get(g_columnLabels.get(dataKey.value, None), g_defaultValues.get(dataKey.value, None))
+  if isinstance(value, (date, time)) and dataKey not in TIME_INFO_KEYS:
+    return value.date().isoformat() if isinstance(value, datetime) else value.isoformat()
+  return value
     
 # return tuple containing quantified and unquantified item info. If a quantity was specified for the item, 
 # only set values for quantified, otherwise only unquantified
@@ -205,6 +264,12 @@ def datetimeToString(dt):
     return dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
   else:
     return None
+
+def stringToDatetime(dtStr):
+  try:
+    return datetime.strptime(dtStr, '%Y-%m-%dT%H:%M:%S.%fZ')
+  except:
+    return None
   
 # compute the context objects for non-transformation events (no from→to data)
 def compute_contexts(data, products, locations):
@@ -238,6 +303,7 @@ def compute_contexts(data, products, locations):
     context = Context()
     context.EventID                = str(uuid.uuid4().urn)
     context.TransformationID       = str(uuid.uuid4().urn)
+    context.EventTime              = timeString
     context.TimeZone               = valueOf(dataItem, DataKey.TIME_ZONE)
     context.Location               = glnOf(locations, company_prefix, valueOf(dataItem, DataKey.LOCATION), valueOf(dataItem, DataKey.LOCATION_EXT))
     context.FromLocation           = glnOf(locations, company_prefix, valueOf(dataItem, DataKey.FROM_LOCATION), valueOf(dataItem, DataKey.FROM_LOCATION_EXT))
@@ -263,6 +329,43 @@ def compute_contexts(data, products, locations):
   return contexts
   
 
+# default Context attributes identifying events which can be merged into one, for --coalesce
+DEFAULT_COALESCE_KEY = 'EventTime,Location,BizStep,Disposition,SSCC,PurchaseOrder'
+
+# attributes of a context which are not compared when merging, since they are unique to each event
+COALESCE_IGNORED_FIELDS = ('EventID', 'TransformationID')
+
+# merge contexts having the same values for the Context attributes in 'keyFields' into a single context, in one pass.
+# Item lists of merged contexts are concatenated; for other attributes, the first context's value is kept
+def coalesce_contexts(contexts, keyFields):
+  result = {}
+  # keys of the merged contexts whose item lists have been copied, so may be extended in place
+  ownsLists = set()
+  for context in contexts:
+    key = tuple(str(getattr(context, field)) for field in keyFields)
+    merged = result.get(key)
+    if not merged:
+      result[key] = context
+      continue
+    if key not in ownsLists:
+      for field, value in vars(merged).items():
+        if isinstance(value, list):
+          setattr(merged, field, list(value))
+      ownsLists.add(key)
+    for field, value in vars(context).items():
+      mergedValue = getattr(merged, field)
+      if isinstance(value, list):
+        if mergedValue is None:
+          setattr(merged, field, list(value))
+        else:
+          mergedValue.extend(value)
+      elif mergedValue is None:
+        setattr(merged, field, value)
+      elif value is not None and value != mergedValue and field not in COALESCE_IGNORED_FIELDS:
+        print('WARNING: coalesce, ' + field + ' ' + str(value) + ' differs from ' + str(mergedValue) + ', keeping first')
+  return list(result.values())
+
+
 # return the appropriate value: either min(currentValue, newValue) if 'useMinValue' == True, otherwise max(currentValue, newValue)
 def __selectGroupValue(currentValue, newValue, useMinValue):
   if not newValue:
@@ -353,11 +456,9 @@ def compute_contexts_from_to(from_data, to_data, products, locations_map, useMin
   to_locations = set()
   
   for group_key in keys:
-    print('Processing Group: ' + group_key)
-    if group_key in from_data:
-      from_data_items_for_group = from_data[group_key] 
-    if group_key in to_data:
-      to_data_items_for_group = to_data[group_key] 
+    print('Processing Group: ' + str(group_key))
+    from_data_items_for_group = from_data.get(group_key)
+    to_data_items_for_group = to_data.get(group_key)
     groupDate = None
 
     quantifiedFromItems = unquantifiedFromItems = []
@@ -400,10 +501,138 @@ def compute_contexts_from_to(from_data, to_data, products, locations_map, useMin
 
 
 
-# render JINJA template
-def render_data(contexts, template, outputFName):
-  with open(outputFName, "w") as outputFile:
-    outputFile.write(template.render(contexts=contexts))
+# number of contexts which may be waiting to be rendered by each output sink
+SINK_QUEUE_SIZE = 256
+
+# size of the write buffer of each output file
+SINK_BUFFER_SIZE = 1 << 20
+
+# marks the end of the contexts passed to a sink
+END_OF_CONTEXTS = object()
+
+# contexts passed to one output sink, iterated by the sink as they are added
+class ContextFeed:
+  def __init__(self):
+    self.queue    = queue.Queue(SINK_QUEUE_SIZE)
+    self.finished = False
+
+  def __iter__(self):
+    while not self.finished:
+      context = self.queue.get()
+      if context is END_OF_CONTEXTS:
+        self.finished = True
+      else:
+        yield context
+
+# render the contexts from 'feed' to a single output file: using a JINJA template, or as JSON lines if template is None
+def render_sink(feed, template, outputFName):
+  try:
+    with open(outputFName, "w", buffering=SINK_BUFFER_SIZE) as outputFile:
+      if template:
+        template.stream(contexts=feed).dump(outputFile)
+      else:
+        for context in feed:
+          outputFile.write(json.dumps(vars(context), default=str) + '\n')
+  except:
+    # consume the remaining contexts, so that render_data is not blocked waiting for this sink
+    for context in feed:
+      pass
+    raise
+
+# extension of the output files of a sink, used for partitioned output
+def sink_extension(template):
+  return os.path.splitext(template.name)[1] if template else '.json'
+
+# copy of a context with new event and transformation IDs, so the same context can be rendered as another event
+def with_new_ids(context):
+  result = copy.copy(context)
+  result.EventID          = str(uuid.uuid4().urn)
+  result.TransformationID = str(uuid.uuid4().urn)
+  return result
+
+# render contexts to each of the (template, outputFName) pairs in 'sinks', in a single pass over the contexts: each
+# context is passed to every sink as it is read, and each sink renders on its own thread. A sink template of None
+# writes the contexts as JSON lines. Each template after the first renders its events with new IDs, so that no
+# two events share an ID; JSON sinks use the same IDs as the first template
+def render_data(contexts, sinks):
+  feeds = [ContextFeed() for sink in sinks]
+  templateSinks = [index for index, (template, outputFName) in enumerate(sinks) if template]
+  newIdFeeds = set(templateSinks[1:])
+  errors = []
+  def render(feed, template, outputFName):
+    try:
+      render_sink(feed, template, outputFName)
+    except Exception as e:
+      errors.append(e)
+  threads = [threading.Thread(target=profiled(render), args=(feed, template, outputFName))
+             for feed, (template, outputFName) in zip(feeds, sinks)]
+  for thread in threads:
+    thread.start()
+  for context in contexts:
+    for index, feed in enumerate(feeds):
+      feed.queue.put(with_new_ids(context) if index in newIdFeeds else context)
+  for feed in feeds:
+    feed.queue.put(END_OF_CONTEXTS)
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+
+# command line names of the supported output partitionings
+PARTITION_GROUPING = {
+  'year':     GroupingFunction.DATE_YEAR,
+  'month':    GroupingFunction.DATE_MONTH,
+  'week':     GroupingFunction.DATE_WEEK,
+  'location': GroupingFunction.EQUALITY
+}
+
+# return the name of the output partition for a context: its event time bucket (e.g. 2026, 2026-10, 2026-W41),
+# or its location for EQUALITY grouping
+def partition_of(grouping_type, context):
+  if grouping_type == GroupingFunction.EQUALITY:
+    return context.Location
+  dateTime = stringToDatetime(context.EventTime)
+  if not dateTime:
+    return None
+  if grouping_type == GroupingFunction.DATE_YEAR:
+    return '{0:04d}'.format(dateTime.year)
+  elif grouping_type == GroupingFunction.DATE_MONTH:
+    return '{0:04d}-{1:02d}'.format(dateTime.year, dateTime.month)
+  elif grouping_type == GroupingFunction.DATE_WEEK:
+    iso_year, iso_week, iso_weekday = dateTime.isocalendar()
+    return '{0:04d}-W{1:02d}'.format(iso_year, iso_week)
+  else:
+    print('WARNING: unknown Grouping type for partition')
+    return None
+
+# render contexts into one output file per partition, for each of the (template, outputDir) pairs in 'sinks',
+# with at most 'maxWriters' output files open at a time. Returns the list of (template, outputFName) pairs written
+def render_partitioned_data(contexts, sinks, grouping_type, maxWriters):
+  partitions = {}
+  for context in contexts:
+    partition = partition_of(grouping_type, context)
+    if not partition:
+      print('WARNING: no partition for event ' + str(context.EventID))
+      partition = 'unknown'
+    if partition in partitions:
+      partitions[partition].append(context)
+    else:
+      partitions[partition] = [context]
+
+  for template, outputDir in sinks:
+    os.makedirs(outputDir, exist_ok=True)
+  partitionSinks = [[(template, os.path.join(outputDir, re.sub(r'[^\w.-]', '_', partition) + sink_extension(template)))
+                     for template, outputDir in sinks]
+                    for partition in partitions]
+  # each partition being rendered has one output file open per sink
+  if maxWriters < len(sinks):
+    raise ValueError('maxWriters (' + str(maxWriters) + ') is less than the number of outputs (' + str(len(sinks)) + ')')
+  with ThreadPoolExecutor(max_workers=maxWriters // len(sinks)) as executor:
+    futures = [executor.submit(profiled(render_data), partitionContexts, outputSinks)
+               for partitionContexts, outputSinks in zip(partitions.values(), partitionSinks)]
+    for future in futures:
+      future.result()
+  return [sink for outputSinks in partitionSinks for sink in outputSinks]
 
 def process_default_overrides(overrides, resultList):
   # process default values passed as command line args which override any from config file
@@ -435,15 +664,19 @@ def computePO_DateRanges(toData):
           result[po] = max(poDate, oldDate)
           #print('result[po] = { max(' + str(poDate) + ', ' + str(oldDate) + ') = ' + str(result[po]))
           
-  # create an inverse mapping from PO to endDate
-  endDateToPO_Map = {v: k for k, v in result.items()}
-
-  # use sorted endDate values to calculate potential date ranges for PO's
-  prev = None
-  for key in sorted(endDateToPO_Map.keys()):
-    result[endDateToPO_Map[key]] = { 'startDate': prev , 'endDate': key }
-    prev = key
-  result[endDateToPO_Map[prev]] = { 'startDate': result[endDateToPO_Map[prev]]['startDate'] , 'endDate': None }
+  # use (endDate, PO) pairs sorted by endDate to calculate potential date ranges for PO's. PO's with the same
+  # endDate share the same range
+  endDates = sorted(result.items(), key=lambda item: (item[1], str(item[0])))
+  result = {}
+  startDate = prev = None
+  for po, endDate in endDates:
+    if prev is not None and endDate != prev:
+      startDate = prev
+    result[po] = { 'startDate': startDate, 'endDate': endDate }
+    prev = endDate
+  for po, endDate in endDates:
+    if endDate == prev:
+      result[po] = { 'startDate': result[po]['startDate'], 'endDate': None }
   #print('computePO_DateRanges, FINAL RESULT: ' + str(result))     
   return result
   
@@ -456,6 +689,8 @@ def dateRangeContains(fromDate, startDate, endDate):
     return False
 
 def mapFromDataItemToPO(dataItem, PO_DateRanges):
+  fromDate = calculateTimeInfo(valueOf(dataItem, DataKey.FROM_DATE), valueOf(dataItem, DataKey.FROM_TIME))
+  #print("fromDate: " + str(fromDate))
   for po in PO_DateRanges:
     currentItem = PO_DateRanges[po]
     #print("currentItem: " + str(currentItem))
@@ -463,8 +698,6 @@ def mapFromDataItemToPO(dataItem, PO_DateRanges):
     #print("startDate: " + str(startDate))
     endDate = currentItem['endDate']
     #print("endDate: " + str(endDate))
-    fromDate = calculateTimeInfo(valueOf(dataItem, DataKey.FROM_DATE), valueOf(dataItem, DataKey.FROM_TIME))
-    #print("fromDate: " + str(fromDate))
     if dateRangeContains(fromDate, startDate, endDate):
       return po
   print('Should not get here')
@@ -482,6 +715,46 @@ def mapAllFromDataToPO(initialFromData, PO_DateRanges):
       #print("CREATING TO GROUP: " + str(po))
   return result
 
+# return the linkage key of a data item: the value of the single link key, or a tuple of values for a
+# composite link. Returns None if any of the link values is missing
+def linkKeyOf(dataItem, linkKeys):
+  values = tuple(valueOf(dataItem, linkKey) for linkKey in linkKeys)
+  if not all(values):
+    return None
+  return values[0] if 1 == len(values) else values
+
+# build a hash index of TO data, grouped by linkage key
+def group_data_by_link(data, linkKeys):
+  result = {}
+  for dataItem in data:
+    key = linkKeyOf(dataItem, linkKeys)
+    if key is None:
+      print('WARNING: group_data_by_link, no link value for ' + str([linkKey.value for linkKey in linkKeys]))
+      continue
+    if key in result:
+      result[key].append(dataItem)
+    else:
+      result[key] = [dataItem]
+  return result
+
+# map each FROM data item to its TO group in one pass, by probing the TO index with the item's linkage key.
+# Items without a matching TO group fall back to the date range heuristic
+def mapAllFromDataToLink(initialFromData, toData, linkKeys):
+  result = {}
+  PO_DateRanges = None
+  for dataItem in initialFromData:
+    key = linkKeyOf(dataItem, linkKeys)
+    if key not in toData:
+      if PO_DateRanges is None:
+        PO_DateRanges = computePO_DateRanges(toData)
+      print('WARNING: no TO data for link ' + str(key) + ', using date range')
+      key = mapFromDataItemToPO(dataItem, PO_DateRanges)
+    if key in result:
+      result[key].append(dataItem)
+    else:
+      result[key] = [dataItem]
+  return result
+
 
 
 if __name__ == "__main__":
@@ -495,6 +768,32 @@ if __name__ == "__main__":
   parser.add_argument("-o", "--outputFile", dest='outputFName', help="output file name")
   parser.add_argument("-m", "--templateFile", dest='templateFName', help="template file name")
 
+  parser.add_argument('--link', action='append', dest='linkKeys',
+                      help="link from and to data by the value of the specified key, e.g. ProductionOrder, Lot, SSCC. "
+                           "Repeat for a composite key. Default is the purchase order date range heuristic")
+  parser.add_argument('--partitionBy', dest='partitionBy', choices=sorted(PARTITION_GROUPING),
+                      help="write one output file per event week, month, year or location. "
+                           "The output file name is used as the output directory")
+  parser.add_argument('--maxWriters', dest='maxWriters', type=int, default=4,
+                      help="maximum number of partitioned output files open at the same time, which must be at least "
+                           "the number of outputs (default 4)")
+  parser.add_argument('--profile', dest='profileFName',
+                      help="write a JSON report of the time taken, and rows/sec and events/sec, for each stage of the run")
+  parser.add_argument('--profileStats', dest='profileStatsFName',
+                      help="with --profile, also write cProfile statistics (.prof) for the whole run")
+  parser.add_argument('--profileMemory', dest='profileMemoryTopN', type=int, default=0,
+                      help="with --profile, also report memory use per stage and the top N allocations, using tracemalloc")
+  parser.add_argument('--cacheDir', dest='cacheDir',
+                      help="directory in which to cache the computed events, reused by later runs with the same "
+                           "input files, --set, --col and --link options (e.g. to render with a different template)")
+  parser.add_argument('--validate', dest='validationFName',
+                      help="validate the output file(s) and write a JSON report of the errors found")
+  parser.add_argument('--coalesce', nargs='?', const=DEFAULT_COALESCE_KEY, dest='coalesceKey',
+                      help="merge events with the same values for the specified comma-separated event fields into a "
+                           "single event. Default fields are " + DEFAULT_COALESCE_KEY)
+  parser.add_argument('--render', action='append', dest='renderPairs',
+                      help="also render the events using another template, to another output file. Format is "
+                           "templateFile=outputFile. Use json as the template file name to write the events as JSON lines")
   parser.add_argument('--set', action='append', dest='defaultOverrides', 
                       help="override a default value for an item in an input file. Format is var=val")
   parser.add_argument('--col', action='append', dest='columnLabels', 
@@ -512,6 +811,40 @@ if __name__ == "__main__":
   if (options.fromInputFName and not options.toInputFName) or (not options.fromInputFName and options.toInputFName):
     print('ERROR: either --inputFile or both --fromInputFile and --toInputFile can be specified')
     exit()
+
+  linkKeys = []
+  for linkKey in options.linkKeys or []:
+    if DataKey.has_value(linkKey):
+      linkKeys.append(DataKey(linkKey))
+    else:
+      print('ERROR: --link ' + linkKey + ' is not a valid key')
+      exit()
+
+  renderPairs = [(options.templateFName, options.outputFName)] if options.templateFName or options.outputFName else []
+  for renderPair in options.renderPairs or []:
+    split = renderPair.split('=')
+    if 2 == len(split) and split[0] and split[1]:
+      renderPairs.append((split[0], split[1]))
+    else:
+      print('ERROR: --render ' + renderPair + ' bad format')
+      exit()
+  if not renderPairs or not all(outputFName for templateFName, outputFName in renderPairs):
+    print('ERROR: --templateFile and --outputFile, or --render, must be specified')
+    exit()
+
+  if options.partitionBy and options.maxWriters < len(renderPairs):
+    print('ERROR: --maxWriters must be at least the number of outputs (' + str(len(renderPairs)) + ')')
+    exit()
+
+  coalesceFields = options.coalesceKey.split(',') if options.coalesceKey else []
+  for field in coalesceFields:
+    if not hasattr(Context(), field):
+      print('ERROR: --coalesce ' + field + ' is not a valid event field')
+      exit()
+
+  if (options.profileStatsFName or options.profileMemoryTopN) and not options.profileFName:
+    print('ERROR: --profileStats and --profileMemory require --profile')
+    exit()
     
   # load config
   with open('config.json', 'r') as f:
@@ -528,41 +861,107 @@ if __name__ == "__main__":
   print('COLUMN LABELS: ' + json.dumps(g_columnLabels, indent=2))
   print('DEFAULT VALUES: ' + json.dumps(g_defaultValues, sort_keys=True, indent=2))
   
-  template = get_template(options.templateFName)
-  products = load_keyed_data(options.productFName, DataKey.MATERIAL.value)
-  locations = load_keyed_data(options.locationFName, DataKey.LOCATION.value)
-
-  # load data for non-transformation events, if necessary
-  data = load_event_data(options.inputFName) if options.inputFName else None
-  
-  # load data for transformation events, if necessary
-  # FOR NOW: assume linkage by PO Number and group by date/PO number
-  initialFromData = load_event_data(options.fromInputFName) if options.fromInputFName else None
-  toData   = load_grouped_data(options.toInputFName, g_columnLabels.get(DataKey.PURCHASE_ORDER.value, None), GroupingFunction.EQUALITY) if options.toInputFName else None  
-  fromData = None
-  if toData and initialFromData:
-    PO_DateRanges = computePO_DateRanges(toData)
-    fromData = mapAllFromDataToPO(initialFromData, PO_DateRanges)
-    print('FROM DATA:' + str(fromData))
-
-  #print('LOCATIONS')
-  #for row in locations:
-  #  print(row)
-  #
-  #print('PRODUCTS')
-  #for row in products:
-  #  print(row)
-  #  
-  #print('DATA')
-  #for row in data:
-  #  print(row)
-  #
-  #print('PRODUCTS: ' + str(products))
+  profiler = StageProfiler(bool(options.profileFName), options.profileStatsFName, options.profileMemoryTopN)
+  profiler.start()
+
+  # output (template, output file) pairs. A template of None writes JSON
+  with profiler.stage('templates'):
+    sinks = [(get_template(templateFName) if templateFName != 'json' else None, outputFName) for templateFName, outputFName in renderPairs]
+
+  # use previously computed contexts for the same inputs and configuration, if cached
+  contexts = None
+  if options.cacheDir:
+    with profiler.stage('cache') as stage:
+      inputFNames = [options.inputFName, options.fromInputFName, options.toInputFName, options.productFName, options.locationFName]
+      cacheKey = context_cache.cache_key(
+        [split_sheet_name(fName)[0] if fName else None for fName in inputFNames],
+        { 'InputFiles':     inputFNames,
+          'ColumnLabels':   g_columnLabels,
+          'DefaultValues':  g_defaultValues,
+          'LinkKeys':       [linkKey.value for linkKey in linkKeys] })
+      contexts = context_cache.load_contexts(options.cacheDir, cacheKey)
+      if contexts is not None:
+        print('USING CACHED EVENTS: ' + context_cache.cache_file_name(options.cacheDir, cacheKey))
+        stage['events'] = len(contexts)
+
+  if contexts is None:
+    with profiler.stage('load') as stage:
+      products = IdentifierIndex(load_keyed_data(options.productFName, DataKey.MATERIAL.value), 'GTIN',
+                                 gs1_urn.gtin14_of, gs1_urn.split_gtin14, lambda row: valueOf(row, DataKey.COMPANY_PREFIX))
+      locations = IdentifierIndex(load_keyed_data(options.locationFName, DataKey.LOCATION.value), 'GLN',
+                                  gs1_urn.gln13_of, gs1_urn.split_gln13, lambda row: valueOf(row, DataKey.COMPANY_PREFIX))
+      products.print_report('product')
+      locations.print_report('location')
+
+      # load data for non-transformation events, if necessary
+      data = load_event_data(options.inputFName) if options.inputFName else None
   
+      # load data for transformation events, if necessary
+      # if no link keys are specified, assume linkage by PO Number and group by date/PO number
+      initialFromData = load_event_data(options.fromInputFName) if options.fromInputFName else None
+      if linkKeys:
+        toData = group_data_by_link(load_event_data(options.toInputFName), linkKeys) if options.toInputFName else None
+      else:
+        toData = load_grouped_data(options.toInputFName, g_columnLabels.get(DataKey.PURCHASE_ORDER.value, None), GroupingFunction.EQUALITY) if options.toInputFName else None  
+      stage['rows'] = len(data) if data else len(initialFromData or []) + sum(len(items) for items in (toData or {}).values())
+
+    fromData = None
+    if toData and initialFromData:
+      with profiler.stage('link') as stage:
+        if linkKeys:
+          fromData = mapAllFromDataToLink(initialFromData, toData, linkKeys)
+        else:
+          PO_DateRanges = computePO_DateRanges(toData)
+          fromData = mapAllFromDataToPO(initialFromData, PO_DateRanges)
+        stage['rows'] = len(initialFromData)
+      print('FROM DATA:' + str(fromData))
+
+    #print('LOCATIONS')
+    #for row in locations:
+    #  print(row)
+    #
+    #print('PRODUCTS')
+    #for row in products:
+    #  print(row)
+    #  
+    #print('DATA')
+    #for row in data:
+    #  print(row)
+    #
+    #print('PRODUCTS: ' + str(products))
+
+    with profiler.stage('contexts') as stage:
+      # if not transformation event
+      if data:
+        contexts = compute_contexts(data, products, locations)
+        stage['rows'] = len(data)
+      # else if transformation event
+      else:
+        contexts = compute_contexts_from_to(fromData, toData, products, locations, True)
+      stage['events'] = len(contexts)
+
+    if options.cacheDir:
+      context_cache.save_contexts(options.cacheDir, cacheKey, contexts)
+
+  if coalesceFields:
+    with profiler.stage('coalesce') as stage:
+      stage['rows'] = len(contexts)
+      contexts = coalesce_contexts(contexts, coalesceFields)
+      stage['events'] = len(contexts)
+    print('COALESCED EVENTS: ' + str(stage['rows']) + ' → ' + str(stage['events']))
+
   # render output file, based on inputs
-  # if not transformation event
-  if data:
-    render_data(compute_contexts(data, products, locations), template, options.outputFName)
-  # else if transformation event
-  else:
-    render_data(compute_contexts_from_to(fromData, toData, products, locations, True), template, options.outputFName)
+  with profiler.stage('render') as stage:
+    if options.partitionBy:
+      outputSinks = render_partitioned_data(contexts, sinks, PARTITION_GROUPING[options.partitionBy], options.maxWriters)
+    else:
+      render_data(contexts, sinks)
+      outputSinks = sinks
+    stage['events'] = len(contexts)
+
+  if options.validationFName:
+    with profiler.stage('validate') as stage:
+      reports = epcis_validator.validate_files([outputFName for template, outputFName in outputSinks if template], options.validationFName)
+      stage['events'] = sum(report['eventCount'] for report in reports)
+
+  profiler.stop(options.profileFName)
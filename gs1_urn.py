@@ -1,6 +1,8 @@
 ### Really simplistic utilities for handling GTIN/GLN/SSCC/etc.
 ###
-### TODO: check for string lengths and pad as necessary, other error checking, so much more...
+### TODO: other error checking, so much more...
+
+import re
 
 # utilities
 def already_urn(code: str):
@@ -12,6 +14,52 @@ def add_urn_suffix_if_necessary(code: str, suffix: str):
   else:
     return code
 
+# GS1 check digit (mod 10) for the digits of a GTIN/GLN/SSCC, not including the check digit
+def gs1_check_digit(digits: str):
+  total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(digits)))
+  return str((10 - total % 10) % 10)
+
+# pad a GS1 identifier (including its check digit) with leading zeros to 'length' digits.
+# Returns None if it is not all digits, is too long, or its check digit is wrong
+def pad_gs1_id(code: str, length: int):
+  code = code.strip() if code else code
+  if not code or not code.isdigit() or len(code) > length:
+    return None
+  code = code.zfill(length)
+  if gs1_check_digit(code[:-1]) != code[-1]:
+    return None
+  return code
+
+# GTIN-8, GTIN-12, GTIN-13 or GTIN-14 as GTIN-14, or None if not a valid GTIN
+def gtin14_of(gtin: str):
+  if not gtin or len(gtin.strip()) not in (8, 12, 13, 14):
+    return None
+  return pad_gs1_id(gtin, 14)
+
+# GLN as GLN-13, or None if not a valid GLN
+def gln13_of(gln: str):
+  return pad_gs1_id(gln, 13)
+
+def split_gtin14(gtin14: str, company_prefix: str):
+  '''
+  :param gtin14: a valid GTIN-14
+  :param company_prefix: The company prefix (GS1).
+  :return: the indicator digit concatenated with the item reference, or None if the GTIN is not in the company prefix
+  '''
+  if not company_prefix or not gtin14[1:].startswith(company_prefix) or len(company_prefix) > 12:
+    return None
+  return gtin14[0] + gtin14[1 + len(company_prefix):13]
+
+def split_gln13(gln13: str, company_prefix: str):
+  '''
+  :param gln13: a valid GLN-13
+  :param company_prefix: The company prefix (GS1).
+  :return: the location reference, or None if the GLN is not in the company prefix
+  '''
+  if not company_prefix or not gln13.startswith(company_prefix) or len(company_prefix) > 12:
+    return None
+  return gln13[len(company_prefix):12]
+
 
 # CLASS-LEVEL objects, e.g.: LGTIN (GTIN+lot)
 #
@@ -167,7 +215,8 @@ def sgln_data_to_urn(company_prefix: str, loc_ref: str, extension: str = None):
   if already_urn(loc_ref):
     return add_urn_suffix_if_necessary(loc_ref, extension)
     
-  if company_prefix and loc_ref:
+  # the location reference is empty for a 12-digit company prefix
+  if company_prefix and loc_ref is not None:
     if (extension):
       return 'urn:epc:id:sgln:{0}.{1}.{2}'.format(company_prefix, loc_ref, extension)
     else:
@@ -210,4 +259,28 @@ def despatch_advice_data_to_urn(company_prefix: str, po: str, da: str):
 
 # Production Order
 def production_order_data_to_urn(company_prefix: str, prod: str):
-  return 'urn:epcglobal:cbv:bt:{0}:{1}'.format(company_prefix, prod)
\ No newline at end of file
+  return 'urn:epcglobal:cbv:bt:{0}:{1}'.format(company_prefix, prod)
+
+
+# URN syntax, for each of the URN schemes generated above. Used to validate generated documents
+URN_PATTERNS = {
+  'lgtin':                re.compile(r'urn:epc:class:lgtin:\d+\.\d+\.\S+'),
+  'sgtin':                re.compile(r'urn:epc:id:sgtin:\d+\.\d+\.\S+'),
+  'sscc':                 re.compile(r'urn:epc:id:sscc:\d+\.\d+'),
+  'sgln':                 re.compile(r'urn:epc:id:sgln:\d+\.\d*(\.\S+)?'),
+  'ift_lgtin':            re.compile(r'urn:ibm:ift:product:lot:class:[^\s.]+\.[^\s.]+(\.\S+)?'),
+  'ift_sgtin':            re.compile(r'urn:ibm:ift:product:serial:obj:[^\s.]+\.[^\s.]+\.\S+'),
+  'ift_logistic_unit':    re.compile(r'urn:ibm:ift:lpn:obj:[^\s.]+\.\S+'),
+  'ift_sgln':             re.compile(r'urn:ibm:ift:location:extension:loc:[^\s.]+\.[^\s.]+(\.\S+)?'),
+  'business_transaction': re.compile(r'urn:epcglobal:cbv:bt:[^\s:]+:\S+')
+}
+
+def urn_scheme_of(urn: str):
+  '''
+  :param urn: a URN string
+  :return: the name of the URN_PATTERNS scheme the URN matches, or None if it matches none of them
+  '''
+  for scheme, pattern in URN_PATTERNS.items():
+    if pattern.fullmatch(urn):
+      return scheme
+  return None
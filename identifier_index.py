@@ -0,0 +1,101 @@
+### Lookup index over product or location master data
+###
+### Built once when the master data is loaded, so that each input row needs a single lookup:
+### • keys are also indexed in normalized form (trimmed, leading zeros stripped, case-folded), so that codes with
+###   stripped zeros or different case still match
+### • GS1 identifiers are padded (GTIN-14, GLN-13) and their check digits verified when the index is built, and the
+###   split of each identifier into company prefix and item/location reference is computed once per company prefix
+
+# utilities for handling GS1 (GTIN, GLN, SSCC, etc.)
+import gs1_urn
+
+
+# normalized form of a master data key: trimmed, leading zeros stripped, case-folded
+def normalize_key(key):
+  key = str(key).strip().casefold()
+  return key.lstrip('0') or ('0' if key else key)
+
+
+# a master data row, with its GS1 identifier in padded form
+class IndexEntry:
+  def __init__(self, key, row, code, gs1Code, split_gs1):
+    self.key        = key
+    self.row        = row
+    self.code       = code          # identifier as given in the master data (GTIN/GLN), if any
+    self.gs1Code    = gs1Code       # padded GS1 identifier (GTIN-14/GLN-13), or None if code is not a valid one
+    self.split_gs1  = split_gs1
+    self.references = {}            # company prefix -> item/location reference, or None if not in the prefix
+
+  def reference(self, company_prefix):
+    '''
+    :param company_prefix: The company prefix (GS1).
+    :return: the item reference (with indicator digit) or location reference of the GS1 identifier within
+             the company prefix, or None if the identifier is not a GS1 identifier in that company prefix
+    '''
+    if not self.gs1Code:
+      return None
+    if company_prefix not in self.references:
+      self.references[company_prefix] = self.split_gs1(self.gs1Code, company_prefix)
+    return self.references[company_prefix]
+
+
+class IdentifierIndex:
+  def __init__(self, data, codeField, to_gs1, split_gs1, companyPrefixOf=None):
+    '''
+    :param data: master data dictionary, from load_keyed_data
+    :param codeField: column containing the GS1 identifier, e.g. 'GTIN' or 'GLN'
+    :param to_gs1: function returning the padded GS1 identifier for a code, or None if invalid, e.g. gs1_urn.gtin14_of
+    :param split_gs1: function splitting a padded GS1 identifier by company prefix, e.g. gs1_urn.split_gtin14
+    :param companyPrefixOf: function returning the company prefix of a master data row (optional), used to
+                            precompute the split of its identifier
+    '''
+    self.codeField  = codeField
+    self.entries    = {}
+    self.normalized = {}
+    self.ambiguous  = {}
+    self.invalid    = []
+
+    for key, row in data.items():
+      code = row.get(codeField)
+      gs1Code = None
+      if code and not gs1_urn.already_urn(code):
+        gs1Code = to_gs1(code)
+        if not gs1Code:
+          self.invalid.append(key)
+      entry = IndexEntry(key, row, code, gs1Code, split_gs1)
+      if companyPrefixOf:
+        entry.reference(companyPrefixOf(row))
+      self.entries[key] = entry
+
+      normalizedKey = normalize_key(key)
+      if normalizedKey in self.ambiguous:
+        self.ambiguous[normalizedKey].append(key)
+      elif normalizedKey in self.normalized:
+        self.ambiguous[normalizedKey] = [self.normalized.pop(normalizedKey).key, key]
+      else:
+        self.normalized[normalizedKey] = entry
+
+  def lookup(self, code):
+    '''
+    :param code: master data key, e.g. a material or plant code
+    :return: the IndexEntry for the code, matched exactly or else by normalized key, or None if not found
+             (or if the normalized key is ambiguous)
+    '''
+    entry = self.entries.get(code)
+    if entry is None and code is not None:
+      entry = self.normalized.get(normalize_key(code))
+    return entry
+
+  def report(self):
+    return {
+      'entries':    len(self.entries),
+      'ambiguous':  self.ambiguous,
+      'invalid':    self.invalid
+    }
+
+  def print_report(self, name):
+    for normalizedKey, keys in self.ambiguous.items():
+      print('WARNING: ' + name + ' keys ' + str(keys) + ' are ambiguous, all normalize to ' + normalizedKey)
+    for key in self.invalid:
+      print('WARNING: ' + name + ' ' + str(key) + ' ' + self.codeField + ' ' + str(self.entries[key].code) +
+            ' is not a valid ' + self.codeField + ' (length or check digit)')
@@ -0,0 +1,185 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+# the running StageProfiler, whose cProfile also collects the threads run with profiled()
+g_activeProfiler = None
+
+def profiled(function):
+  '''
+  :param function: function to be run on another thread
+  :return: the function, wrapped so that its calls are included in the cProfile of the running StageProfiler, if any
+  '''
+  profiler = g_activeProfiler
+  if not profiler or not profiler.profile:
+    return function
+
+  def run(*args, **kwargs):
+    threadProfile = cProfile.Profile()
+    try:
+      threadProfile.enable()
+    except ValueError:
+      # only one profiler may be active from Python 3.12, where the profile of the run already covers all threads
+      return function(*args, **kwargs)
+    try:
+      return function(*args, **kwargs)
+    finally:
+      threadProfile.disable()
+      with profiler.threadProfilesLock:
+        profiler.threadProfiles.append(threadProfile)
+  return run
+
+
+# Collects timings for each stage of a run (with rows/sec and events/sec, if counts are given), and
+# optionally a cProfile of the whole run and the top memory allocations, as reported by tracemalloc.
+# Traced memory is sampled while stages run, and the allocations reported are from the snapshot taken
+# closest to peak memory use.
+#
+# Usage:
+#   profiler = StageProfiler(enabled=True)
+#   profiler.start()
+#   with profiler.stage('load') as stage:
+#     data = ...
+#     stage['rows'] = len(data)
+#   profiler.stop('profile.json')
+#
+# cProfile only profiles the thread it is started on; functions run on other threads should be wrapped with profiled().
+class StageProfiler:
+  # seconds between checks of traced memory, and the growth over the last snapshot needed to take a new one
+  MEMORY_SAMPLE_INTERVAL  = 0.05
+  MEMORY_SNAPSHOT_GROWTH  = 1.1
+
+  def __init__(self, enabled: bool = False, cProfileFName: str = None, memoryTopN: int = 0):
+    '''
+    :param enabled: if False, all methods are no-ops
+    :param cProfileFName: if set, name of the cProfile (.prof) file to write for the whole run
+    :param memoryTopN: if > 0, number of top allocation sites to report, using tracemalloc
+    '''
+    self.enabled        = enabled
+    self.cProfileFName  = cProfileFName
+    self.memoryTopN     = memoryTopN
+    self.stages         = []
+    self.startTime      = None
+    self.profile        = None
+    self.threadProfiles = []
+    self.threadProfilesLock = threading.Lock()
+    self.peakStage      = None
+    self.peakSize       = 0
+    self.peakSnapshot   = None
+    self.currentStage   = None
+    self.sampler        = None
+    self.samplerStopped = threading.Event()
+    self.snapshotLock   = threading.Lock()
+
+  def start(self):
+    global g_activeProfiler
+    if not self.enabled:
+      return
+    g_activeProfiler = self
+    if self.memoryTopN:
+      tracemalloc.start()
+      self.sampler = threading.Thread(target=self.sample_memory, daemon=True)
+      self.sampler.start()
+    if self.cProfileFName:
+      self.profile = cProfile.Profile()
+      self.profile.enable()
+    self.startTime = time.perf_counter()
+
+  # take a snapshot if traced memory has grown enough since the last one, so that the last snapshot taken is
+  # close to the peak memory use of the run
+  def snapshot_if_peak(self, stageName):
+    with self.snapshotLock:
+      current, peak = tracemalloc.get_traced_memory()
+      if current > self.peakSize * self.MEMORY_SNAPSHOT_GROWTH:
+        self.peakSnapshot = tracemalloc.take_snapshot()
+        self.peakStage = stageName
+        self.peakSize = current
+
+  # check traced memory periodically, while stages are running
+  def sample_memory(self):
+    while not self.samplerStopped.wait(self.MEMORY_SAMPLE_INTERVAL):
+      stageName = self.currentStage
+      if stageName:
+        self.snapshot_if_peak(stageName)
+
+  @contextmanager
+  def stage(self, name: str):
+    '''
+    Time the enclosed block as stage 'name'. Yields a dict in which the caller may set 'rows' and/or 'events',
+    the number of input rows and output events handled by the stage.
+    '''
+    counts = {'rows': None, 'events': None}
+    if not self.enabled:
+      yield counts
+      return
+
+    if self.memoryTopN:
+      tracemalloc.reset_peak()
+    self.currentStage = name
+    startTime = time.perf_counter()
+    yield counts
+    seconds = time.perf_counter() - startTime
+    self.currentStage = None
+
+    result = {'stage': name, 'seconds': seconds}
+    for countName in ('rows', 'events'):
+      if counts[countName] is not None:
+        result[countName] = counts[countName]
+        result[countName + 'PerSecond'] = counts[countName] / seconds if seconds else None
+    if self.memoryTopN:
+      current, peak = tracemalloc.get_traced_memory()
+      result['memoryCurrentBytes'] = current
+      result['memoryPeakBytes'] = peak
+      # stages shorter than the sampling interval are only checked at their end
+      self.snapshot_if_peak(name)
+    self.stages.append(result)
+
+  def report(self):
+    result = {
+      'totalSeconds': time.perf_counter() - self.startTime,
+      'stages':       self.stages
+    }
+    if self.cProfileFName:
+      result['cProfile'] = self.cProfileFName
+    if self.peakSnapshot:
+      # leave out allocations made by imports and by tracemalloc itself
+      snapshot = self.peakSnapshot.filter_traces([
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__)
+      ])
+      result['memoryTopAllocations'] = {
+        'stage':        self.peakStage,
+        'tracedBytes':  self.peakSize,
+        'top':          [{'location': str(stat.traceback), 'sizeBytes': stat.size, 'count': stat.count}
+                         for stat in snapshot.statistics('lineno')[:self.memoryTopN]]
+      }
+    return result
+
+  def stop(self, reportFName: str):
+    '''
+    Stop profiling and write the JSON report to 'reportFName' (and the cProfile file, if requested)
+    '''
+    global g_activeProfiler
+    if not self.enabled:
+      return
+    g_activeProfiler = None
+    if self.sampler:
+      self.samplerStopped.set()
+      self.sampler.join()
+    if self.profile:
+      self.profile.disable()
+      stats = pstats.Stats(self.profile)
+      for threadProfile in self.threadProfiles:
+        stats.add(threadProfile)
+      stats.dump_stats(self.cProfileFName)
+    result = self.report()
+    if self.memoryTopN:
+      tracemalloc.stop()
+    with open(reportFName, 'w') as reportFile:
+      json.dump(result, reportFile, indent=2)
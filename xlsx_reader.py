@@ -0,0 +1,48 @@
+### Streaming reader for Excel (.xlsx) spreadsheets
+###
+### Requires openpyxl (pip install openpyxl), which is only imported when an .xlsx file is read.
+
+from datetime import date, time
+from itertools import zip_longest
+
+
+# convert an Excel cell value to the value csv.DictReader would produce for the same cell, except that
+# date/time cells are kept as datetime/date/time values rather than formatted as strings
+def cell_value(value):
+  if value is None:
+    return ''
+  if isinstance(value, (date, time)):
+    return value
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return str(value)
+
+def read_xlsx_rows(fName, sheetName=None):
+  '''
+  :param fName: the .xlsx file name
+  :param sheetName: name of the sheet to read (optional). If not specified, the active sheet is read
+  :return: generator of rows, each a dictionary keyed by the column headers in the first row of the sheet
+
+  The workbook is opened read-only, so rows are read one at a time rather than loading the whole sheet.
+  '''
+  try:
+    import openpyxl
+  except ImportError:
+    raise ImportError('openpyxl is required to read .xlsx input files (pip install openpyxl)')
+
+  workbook = openpyxl.load_workbook(fName, read_only=True, data_only=True)
+  try:
+    sheet = workbook[sheetName] if sheetName else workbook.active
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if not header:
+      return
+    header = [cell_value(label) for label in header]
+    for row in rows:
+      # skip blank rows, as csv.DictReader does
+      if all(value is None or value == '' for value in row):
+        continue
+      yield {label: (None if value is None and column >= len(row) else cell_value(value))
+             for column, (label, value) in enumerate(zip_longest(header, row)) if label}
+  finally:
+    workbook.close()